@@ -1,21 +1,39 @@
+# socketやthreadingを使うモジュールより先に、標準ライブラリを協調型のグリーンスレッド版に置き換える
+from gevent import monkey
+monkey.patch_all()
+
 import os
-from flask import Flask, render_template, request, jsonify, send_file
-from flask_socketio import SocketIO, emit
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
+from werkzeug.exceptions import NotFound
+from werkzeug.utils import safe_join
+from flask_socketio import SocketIO
 from youtube_transcript_api import YouTubeTranscriptApi, NoTranscriptFound, TranscriptsDisabled
 import re
 import json
-from datetime import datetime
 from dotenv import load_dotenv
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, quote
 import logging
 import traceback
 import requests
+from requests.adapters import HTTPAdapter
 from pathlib import Path
 import yt_dlp
+from yt_dlp.utils import download_range_func
 import subprocess
+import socket
+from gevent.pywsgi import WSGIServer
+from geventwebsocket.handler import WebSocketHandler
 import webbrowser
 import threading
 import time
+import uuid
+import gzip
+import hashlib
+import brotli
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from collections import OrderedDict
 
 # ロギングの設定
 logging.basicConfig(
@@ -27,52 +45,288 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 app = Flask(__name__)
-socketio = SocketIO(app)
+# ロングポーリングを経由せず、最初からWebSocketで接続させる
+socketio = SocketIO(app, async_mode='gevent', transports=['websocket'])
 
 # ディレクトリの設定
 DOWNLOADS_DIR = Path('downloads')
 DOWNLOADS_DIR.mkdir(exist_ok=True)
 
+# リクエスト本文の上限（1MiB）。超える場合は解析する前に拒否する
+app.config['MAX_CONTENT_LENGTH'] = 1 << 20
+
+# テンプレートでパスからファイル名を取り出すためのフィルター
+app.add_template_filter(os.path.basename, 'basename')
+
+# 字幕取得・動画切り出しジョブを同時に実行する数
+MAX_CONCURRENT_JOBS = 4
+
+# 字幕取得結果をキャッシュする件数と有効期限（秒）
+PROCESS_CACHE_SIZE = 256
+PROCESS_CACHE_TTL = 3600
+
+# 字幕取得結果を切り出し時に参照するセッションの件数と有効期限（秒）
+SESSION_CACHE_SIZE = 1024
+SESSION_TTL = 7200
+
+# ビデオIDを抽出する対象のYouTubeのホスト名
+YOUTUBE_HOSTS = ('www.youtube.com', 'youtube.com', 'm.youtube.com', 'music.youtube.com')
+
+# メインページをブラウザにキャッシュさせる時間（秒）
+INDEX_MAX_AGE = 300
+
+# 配信名に内容のハッシュを含む静的ファイルと、そのキャッシュ時間（秒）
+STATIC_ASSETS = {
+    'app.css': 'text/css',
+    'app.js': 'text/javascript'
+}
+ASSET_MAX_AGE = 31536000
+
+# 切り出した動画をブラウザにキャッシュさせる時間（秒）
+VIDEO_MAX_AGE = 86400
+# nginxのinternalロケーションのパス（設定時は動画の送信をX-Accel-Redirectでnginxに任せる）
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX')
+
+# ファイル書き込み時のバッファサイズ（1MiB）
+WRITE_BUFFER_SIZE = 1 << 20
+
+# 動画切り出しの設定
+# CLIP_FAST_CUT=1 の場合はストリームコピーで切り出し、キーフレームまでの先頭部分のみ再エンコードする
+FAST_CUT = os.environ.get('CLIP_FAST_CUT', '1') == '1'
+# CLIP_DOWNLOAD_SECTIONS=1 の場合は動画全体をダウンロードせず、セグメントごとに必要な区間のみをダウンロードする
+DOWNLOAD_SECTIONS = os.environ.get('CLIP_DOWNLOAD_SECTIONS', '0') == '1'
+# ダウンロードする動画の形式（最高画質の映像と音声を取得し、再エンコードせずにmp4へ結合する）
+VIDEO_FORMAT = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo+bestaudio/best'
+# 開始位置がキーフレーム上にあるとみなす許容誤差（秒）
+KEYFRAME_TOLERANCE = 0.05
+# 再エンコード時に優先して使用するハードウェアエンコーダーと画質設定
+HARDWARE_VIDEO_ENCODERS = [
+    ('h264_nvenc', ['-preset', 'p4', '-cq', '19']),
+    ('h264_videotoolbox', ['-q:v', '60']),
+    ('h264_qsv', ['-global_quality', '19']),
+]
+# ハードウェアエンコーダーが使用できない場合の設定
+SOFTWARE_VIDEO_ENCODER = ('libx264', ['-preset', 'slow', '-crf', '18'])
+# 端数部分の再エンコードで元動画に合わせられるH.264のプロファイル（ffprobeの表記 → エンコーダーの指定）
+H264_PART_PROFILES = {
+    'Constrained Baseline': 'baseline',
+    'Baseline': 'baseline',
+    'Main': 'main',
+    'High': 'high'
+}
+
+# ChatGPTの応答の各セグメントに必要なフィールドと、そのうちの評価値フィールド
+REQUIRED_SEGMENT_FIELDS = ('start', 'end', 'impact', 'uniqueness', 'timeliness', 'entertainment', 'reason')
+SCORE_FIELDS = ('impact', 'uniqueness', 'timeliness', 'entertainment')
+
+# 進捗通知の最小間隔（秒）と、タスクごとの最後に通知した進捗状況
+PROGRESS_EMIT_INTERVAL = 0.1
+PROGRESS_TASKS = ('subtitles', 'video')
+last_progress = {}
+last_progress_lock = threading.Lock()
+
+# 起動時にブラウザを開く前、サーバーの待ち受け開始を確認する間隔と上限（秒）
+BROWSER_POLL_INTERVAL = 0.05
+BROWSER_WAIT_TIMEOUT = 10
+
+# 正規表現パターン
+TAG_RE = re.compile(r'<[^>]+>')
+WHITESPACE_RE = re.compile(r'\s+')
+UNSAFE_FILENAME_RE = re.compile(r'[<>:"/\\|?*]')
+SUBTITLE_LINE_RE = re.compile(r'^\[(\d{2}):(\d{2}):(\d{2})\].*$', re.MULTILINE)
+TIME_RE = re.compile(r'^(\d{1,2}):?(\d{2}):?(\d{2})$')
+VIDEO_ID_RE = re.compile(r'[A-Za-z0-9_-]{11}')
+
+# 字幕テキストから削除する特殊文字（ゼロ幅スペース、BOM）
+SPECIAL_CHARS_TABLE = str.maketrans({'\u200b': None, '\ufeff': None})
+
+class TTLCache:
+    """有効期限と最大件数を持つスレッドセーフなキャッシュ"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """有効期限内の値を取得（存在しない場合はNone）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """値を保存（最大件数を超えた場合は最も古いものから破棄）"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """全ての値を破棄"""
+        with self._lock:
+            self._entries.clear()
+
+# バックグラウンドジョブの実行用スレッドプール
+job_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS)
+
+# 字幕取得結果のキャッシュ（ビデオIDをキーとする）
+process_cache = TTLCache(maxsize=PROCESS_CACHE_SIZE, ttl=PROCESS_CACHE_TTL)
+
+# 字幕ファイルと動画URLを保持するセッション（セッションIDをキーとする）
+sessions = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_TTL)
+
+# YouTubeへのHTTPリクエストでTCP/TLS接続を使い回すセッション
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=20))
+
+# 動画情報の取得に使い回すyt-dlpのインスタンスは同時に使用できないため、ジョブのワーカーごとに保持する
+info_downloader_local = threading.local()
+
+@lru_cache(maxsize=1024)
 def extract_video_id(url):
     """YouTubeのURLからビデオIDを抽出"""
     try:
         parsed_url = urlparse(url)
-        if parsed_url.hostname in ['www.youtube.com', 'youtube.com']:
+        video_id = None
+        if parsed_url.hostname in YOUTUBE_HOSTS:
             if parsed_url.path == '/watch':
-                return parse_qs(parsed_url.query).get('v', [None])[0]
-            elif parsed_url.path.startswith(('/live/', '/shorts/')):
-                return parsed_url.path.split('/')[-1]
+                video_id = parse_qs(parsed_url.query).get('v', [None])[0]
+            elif parsed_url.path.startswith(('/live/', '/shorts/', '/embed/')):
+                video_id = parsed_url.path.split('/')[-1]
         elif parsed_url.hostname == 'youtu.be':
-            return parsed_url.path[1:]
+            video_id = parsed_url.path[1:]
+        # ビデオIDはファイル名にも使うため、形式が正しいもののみを返す
+        if video_id and VIDEO_ID_RE.fullmatch(video_id):
+            return video_id
         return None
     except Exception as e:
         logger.error(f"Error extracting video ID: {e}")
         return None
 
+def get_process_meta_path(video_id):
+    """字幕取得結果のメタデータファイルのパスを取得"""
+    return DOWNLOADS_DIR / f"{video_id}.meta.json"
+
+def load_process_result(video_id):
+    """字幕取得結果をキャッシュから取得（メモリ上になければメタデータファイルから復元）"""
+    cached = process_cache.get(video_id)
+    if cached:
+        return cached
+
+    meta_path = get_process_meta_path(video_id)
+    try:
+        if time.time() - meta_path.stat().st_mtime > PROCESS_CACHE_TTL:
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        # 別の動画の字幕ファイルを読み込まないよう、保存時のビデオIDを確認
+        if meta['video_id'] != video_id:
+            return None
+        with open(meta['subtitle_file'], 'r', encoding='utf-8') as f:
+            subtitles = f.read().splitlines()
+    except (OSError, ValueError, KeyError):
+        return None
+
+    cached = (subtitles, meta['video_title'], meta['subtitle_file'])
+    process_cache.set(video_id, cached)
+    return cached
+
+def save_process_result(video_id, subtitles, video_title, subtitle_file):
+    """字幕取得結果をキャッシュし、再起動後も使えるようメタデータファイルにも保存"""
+    process_cache.set(video_id, (subtitles, video_title, subtitle_file))
+    try:
+        meta = {
+            'video_id': video_id,
+            'video_title': video_title,
+            'subtitle_file': subtitle_file
+        }
+        with open(get_process_meta_path(video_id), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+    except OSError as e:
+        logger.error(f"Error saving process metadata: {e}")
+
+def get_info_downloader():
+    """動画情報の取得用のyt-dlpのインスタンスを取得（接続を再利用するため、ワーカーごとに作成して使い回す）"""
+    downloader = getattr(info_downloader_local, 'downloader', None)
+    if downloader is not None:
+        return downloader
+    ydl_opts = {
+        'writesubtitles': True,
+        'writeautomaticsub': True,
+        'subtitleslangs': ['ja', 'ja-JP', 'en'],
+        'skip_download': True,
+        # タイトルと字幕のみが必要なため、動画形式のマニフェストは解析しない
+        'youtube_include_dash_manifest': False,
+        'youtube_include_hls_manifest': False,
+        'quiet': True,
+        'no_warnings': True,
+        'subtitlesformat': 'vtt'
+    }
+    info_downloader_local.downloader = yt_dlp.YoutubeDL(ydl_opts)
+    return info_downloader_local.downloader
+
+@lru_cache(maxsize=32)
+def extract_video_info(video_id):
+    """yt-dlpで動画情報（タイトルと字幕情報）を取得"""
+    # タイトルと字幕の取得で同じ結果を使い回すため、1動画につき1回だけ抽出する
+    info = get_info_downloader().extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
+    # 動画情報全体はキャッシュせず、使用するタイトルと対象言語の字幕情報のみを保持する
+    langs = ('ja', 'ja-JP', 'en')
+    return {
+        'title': info['title'],
+        'subtitles': {lang: tracks for lang, tracks in (info.get('subtitles') or {}).items() if lang in langs},
+        'automatic_captions': {lang: tracks for lang, tracks in (info.get('automatic_captions') or {}).items() if lang in langs}
+    }
+
+@lru_cache(maxsize=512)
+def fetch_video_title(video_id):
+    """動画タイトルを取得（取得できない場合は例外を送出）"""
+    video_url = f"https://www.youtube.com/watch?v={video_id}"
+    try:
+        # oEmbedで軽量にタイトルを取得
+        response = http_session.get(
+            'https://www.youtube.com/oembed',
+            params={'url': video_url, 'format': 'json'},
+            timeout=5
+        )
+        response.raise_for_status()
+        return response.json()['title']
+    except Exception as e:
+        logger.warning(f"Error fetching video info via oEmbed, falling back to yt-dlp: {e}")
+
+    # yt-dlpを使用して動画情報を取得
+    return extract_video_info(video_id)['title']
+
 def get_video_info(video_id):
     """YouTubeの動画情報を取得"""
     try:
-        # yt-dlpを使用して動画情報を取得
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
-            return info.get('title', f'video_{video_id}')
+        return fetch_video_title(video_id)
     except Exception as e:
         logger.error(f"Error fetching video info: {e}")
         return f'video_{video_id}'
 
+@lru_cache(maxsize=8192)
+def format_seconds(total_seconds):
+    """整数の秒数を[HH:MM:SS]形式に変換"""
+    hours = total_seconds // 3600
+    minutes = (total_seconds % 3600) // 60
+    seconds = total_seconds % 60
+    return f"[{hours:02d}:{minutes:02d}:{seconds:02d}]"
+
 def format_time(seconds):
     """秒数を[HH:MM:SS]形式に変換"""
     try:
-        total_seconds = int(float(seconds))
-        hours = total_seconds // 3600
-        minutes = (total_seconds % 3600) // 60
-        seconds = total_seconds % 60
-        return f"[{hours:02d}:{minutes:02d}:{seconds:02d}]"
+        # 小数部を切り捨ててからキャッシュを引くことで、同じ秒の字幕で結果を共有する
+        return format_seconds(int(float(seconds)))
     except Exception as e:
         logger.error(f"Error formatting time: {e}")
         return "[00:00:00]"
@@ -81,11 +335,11 @@ def clean_text(text):
     """字幕テキストのクリーニング"""
     try:
         # HTMLタグの削除
-        text = re.sub(r'<[^>]+>', '', text)
-        # 複数の空白を1つに
-        text = re.sub(r'\s+', ' ', text)
+        text = TAG_RE.sub('', text)
         # 特殊文字の正規化
-        text = text.replace('\u200b', '').replace('\ufeff', '')
+        text = text.translate(SPECIAL_CHARS_TABLE)
+        # 複数の空白を1つに
+        text = WHITESPACE_RE.sub(' ', text)
         # 先頭と末尾の空白を削除
         return text.strip()
     except Exception as e:
@@ -120,78 +374,96 @@ def get_subtitles_from_youtube_transcript_api(video_id):
 def get_subtitles_from_yt_dlp(video_id):
     """yt-dlpを使用して字幕を取得"""
     try:
-        ydl_opts = {
-            'writesubtitles': True,
-            'writeautomaticsub': True,
-            'subtitleslangs': ['ja', 'ja-JP', 'en'],
-            'skip_download': True,
-            'quiet': True,
-            'no_warnings': True,
-            'subtitlesformat': 'vtt'
-        }
+        info = extract_video_info(video_id)
+        subtitles = info.get('subtitles', {})
+        automatic_captions = info.get('automatic_captions', {})
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
-            subtitles = info.get('subtitles', {})
-            automatic_captions = info.get('automatic_captions', {})
-            
-            # 優先順位に従って字幕を探す
-            for lang in ['ja', 'ja-JP', 'en']:
-                if lang in subtitles:
-                    return subtitles[lang], None
-                if lang in automatic_captions:
-                    return automatic_captions[lang], None
-                    
+        # 優先順位に従って字幕を探す
+        for lang in ['ja', 'ja-JP', 'en']:
+            if lang in subtitles:
+                return subtitles[lang], None
+            if lang in automatic_captions:
+                return automatic_captions[lang], None
+                
         return None, "字幕が見つかりませんでした"
     except Exception as e:
         logger.error(f"Error in get_subtitles_from_yt_dlp: {e}")
         return None, str(e)
 
-def download_video_and_subtitles(url):
+def emit_progress(sid, task, progress):
+    """進捗状況をジョブを開始したクライアントに通知（開始時と完了時以外は最大10Hzに間引く）"""
+    if sid is None:
+        return
+    progress = int(progress)
+    now = time.monotonic()
+    # 同時に実行中の他のジョブの通知で間引かれないよう、クライアントとタスクの組ごとに記録する
+    key = (sid, task)
+    with last_progress_lock:
+        last = last_progress.get(key)
+        if progress not in (0, 100) and last and (last[0] == progress or now - last[1] < PROGRESS_EMIT_INTERVAL):
+            return
+        if progress == 100:
+            last_progress.pop(key, None)
+        else:
+            last_progress[key] = (progress, now)
+    socketio.emit('progress_update', {'task': task, 'progress': progress}, to=sid)
+
+def clear_progress(sid):
+    """ジョブの終了時に、そのクライアントの進捗通知の記録を削除"""
+    with last_progress_lock:
+        for task in PROGRESS_TASKS:
+            last_progress.pop((sid, task), None)
+
+def download_video_and_subtitles(url, sid=None):
     """YouTubeの動画から字幕を取得（複数の方法を試行）"""
     try:
         # 進捗状況を0%に設定
-        socketio.emit('progress_update', {'task': 'subtitles', 'progress': 0})
+        emit_progress(sid, 'subtitles', 0)
         
         video_id = extract_video_id(url)
         if not video_id:
             logger.error("Invalid YouTube URL")
             return None, "無効なYouTube URLです。", None, None
 
-        # 動画情報の取得
-        video_title = get_video_info(video_id)
-        socketio.emit('progress_update', {'task': 'subtitles', 'progress': 20})
-        
-        # 方法1: YouTube Transcript APIを使用
-        logger.info("Trying YouTube Transcript API...")
-        transcript, error1 = get_subtitles_from_youtube_transcript_api(video_id)
-        socketio.emit('progress_update', {'task': 'subtitles', 'progress': 40})
+        # 動画情報の取得と字幕の取得（方法1）を並行して実行
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            video_title_future = executor.submit(get_video_info, video_id)
+
+            # 方法1: YouTube Transcript APIを使用
+            logger.info("Trying YouTube Transcript API...")
+            transcript, error1 = get_subtitles_from_youtube_transcript_api(video_id)
+            emit_progress(sid, 'subtitles', 20)
+
+            video_title = video_title_future.result()
+        emit_progress(sid, 'subtitles', 40)
         
         if transcript:
             formatted_subtitles = []
             current_text = []
-            current_time = None
+            current_seconds = None
             
             for item in transcript:
-                time = format_time(item['start'])
                 text = clean_text(item['text'])
-                
                 if not text:
                     continue
-                    
-                if current_time == time:
+
+                # 秒数のまま比較し、[HH:MM:SS]形式への変換は字幕の確定時にのみ行う
+                seconds = int(float(item['start']))
+                if current_seconds == seconds:
                     current_text.append(text)
                 else:
-                    if current_time and current_text:
-                        formatted_subtitles.append(f"{current_time} {' '.join(current_text)}")
-                    current_time = time
-                    current_text = [text]
+                    # 確定した字幕を追加し、バッファは新しく作らずに使い回す
+                    if current_text:
+                        formatted_subtitles.append(f"{format_time(current_seconds)} {' '.join(current_text)}")
+                        current_text.clear()
+                    current_seconds = seconds
+                    current_text.append(text)
             
             # 最後の字幕を追加
-            if current_time and current_text:
-                formatted_subtitles.append(f"{current_time} {' '.join(current_text)}")
+            if current_text:
+                formatted_subtitles.append(f"{format_time(current_seconds)} {' '.join(current_text)}")
             
-            socketio.emit('progress_update', {'task': 'subtitles', 'progress': 80})
+            emit_progress(sid, 'subtitles', 80)
         else:
             # 方法2: yt-dlpを使用
             logger.info("Trying yt-dlp...")
@@ -214,14 +486,15 @@ def download_video_and_subtitles(url):
             return None, "字幕の内容を抽出できませんでした。", video_title, None
         
         # 字幕ファイルを保存
-        safe_title = re.sub(r'[<>:"/\\|?*]', '_', video_title)
-        subtitle_output = DOWNLOADS_DIR / f"{safe_title}_subtitles.txt"
+        safe_title = UNSAFE_FILENAME_RE.sub('_', video_title)
+        # 同じタイトルの別動画で上書きしないよう、ファイル名にビデオIDを含める
+        subtitle_output = DOWNLOADS_DIR / f"{safe_title}_{video_id}_subtitles.txt"
         
-        with open(subtitle_output, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(formatted_subtitles))
+        with open(subtitle_output, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as f:
+            f.writelines(f"{line}\n" for line in formatted_subtitles)
         
         logger.info(f"Successfully saved subtitles to {subtitle_output}")
-        socketio.emit('progress_update', {'task': 'subtitles', 'progress': 100})
+        emit_progress(sid, 'subtitles', 100)
         return formatted_subtitles, None, video_title, str(subtitle_output)
             
     except Exception as e:
@@ -230,24 +503,12 @@ def download_video_and_subtitles(url):
         logger.error(traceback.format_exc())
         return None, error_msg, None, None
 
-def create_gpt_prompt(subtitles, video_title):
-    """ChatGPT用のプロンプトを作成"""
-    json_format = '''[
-    {
-        "title": "セグメントのタイトル",
-        "start": "HH:MM:SS",
-        "end": "HH:MM:SS",
-        "impact": 整数値(1-10),
-        "uniqueness": 整数値(1-10),
-        "timeliness": 整数値(1-10),
-        "entertainment": 整数値(1-10),
-        "reason": "選択理由（100-500文字）"
-    }
-]'''
+# ChatGPT用プロンプトの定型部分（動画タイトルと字幕の前後に挿入する）
+PROMPT_HEADER = """あなたの回答は必ずJSONフォーマットで出力してください。説明文や追加のコメントは一切含めないでください。
 
-    base_prompt = f"""あなたの回答は必ずJSONフォーマットで出力してください。説明文や追加のコメントは一切含めないでください。
+以下の動画「"""
 
-以下の動画「{video_title}」の字幕データから、切り抜きに適した面白い部分を特定し、JSONで出力してください。
+PROMPT_CRITERIA = """」の字幕データから、切り抜きに適した面白い部分を特定し、JSONで出力してください。
 
 評価基準:
 1. インパクト (1-10):
@@ -271,11 +532,24 @@ def create_gpt_prompt(subtitles, video_title):
    - 視聴者の興味を引く話題性
 
 ##
-{chr(10).join(subtitles)}
+"""
+
+PROMPT_FOOTER = """
 ##
 
 出力形式: 必ずJSONで出力してください。以下の形式以外の文章は含めないでください。
-{json_format}
+[
+    {
+        "title": "セグメントのタイトル",
+        "start": "HH:MM:SS",
+        "end": "HH:MM:SS",
+        "impact": 整数値(1-10),
+        "uniqueness": 整数値(1-10),
+        "timeliness": 整数値(1-10),
+        "entertainment": 整数値(1-10),
+        "reason": "選択理由（100-500文字）"
+    }
+]
 
 制約条件:
 1. 必ずJSONとして有効な形式で出力すること
@@ -288,32 +562,41 @@ def create_gpt_prompt(subtitles, video_title):
 8. タイトルは簡潔で内容を表すものにすること
 
 最後の注意: 回答は上記のJSONフォーマットのみとし、それ以外の文章は一切含めないでください。"""
-    
-    return base_prompt
 
-def filter_subtitles_by_time(subtitles, start_time, end_time):
+def create_gpt_prompt(subtitles, video_title):
+    """ChatGPT用のプロンプトを作成"""
+    # 定型部分は使い回し、タイトルと字幕だけを一度の結合で差し込む
+    return ''.join((PROMPT_HEADER, video_title, PROMPT_CRITERIA, '\n'.join(subtitles), PROMPT_FOOTER))
+
+def hms_to_seconds(time_str):
+    """HH:MM:SS形式の時間を秒数に変換"""
+    return int(time_str[0:2]) * 3600 + int(time_str[3:5]) * 60 + int(time_str[6:8])
+
+def build_subtitle_index(subtitles):
+    """字幕（行のリストまたはテキスト全体）から、字幕行を開始時刻（秒）順に並べた検索用インデックスを作成"""
+    if isinstance(subtitles, str):
+        # 行に分割せず、テキスト全体を1回の正規表現走査で[HH:MM:SS]形式の行を抽出
+        matches = SUBTITLE_LINE_RE.finditer(subtitles)
+    else:
+        matches = filter(None, map(SUBTITLE_LINE_RE.match, subtitles))
+
+    entries = [
+        (int(match[1]) * 3600 + int(match[2]) * 60 + int(match[3]), match[0])
+        for match in matches
+    ]
+
+    entries.sort(key=lambda entry: entry[0])
+    return [seconds for seconds, _ in entries], [line for _, line in entries]
+
+def filter_subtitles_by_time(subtitle_index, start_time, end_time):
     """指定された時間範囲内の字幕を抽出"""
-    filtered = []
     try:
-        def time_to_seconds(time_str):
-            h, m, s = map(int, time_str.split(':'))
-            return h * 3600 + m * 60 + s
+        start_seconds = hms_to_seconds(start_time)
+        end_seconds = hms_to_seconds(end_time)
 
-        start_seconds = time_to_seconds(start_time)
-        end_seconds = time_to_seconds(end_time)
-
-        for line in subtitles:
-            if not line.strip():
-                continue
-            
-            # [HH:MM:SS]形式から時間を抽出
-            match = re.match(r'\[(\d{2}):(\d{2}):(\d{2})\](.*)', line)
-            if match:
-                h, m, s, text = match.groups()
-                subtitle_seconds = time_to_seconds(f"{h}:{m}:{s}")
-                
-                if start_seconds <= subtitle_seconds <= end_seconds:
-                    filtered.append(line)
+        # 開始時刻でソート済みのため二分探索で範囲を特定
+        stamps, lines = subtitle_index
+        filtered = lines[bisect_left(stamps, start_seconds):bisect_right(stamps, end_seconds)]
 
         logger.info(f"Filtered subtitles: {len(filtered)} lines between {start_time} and {end_time}")
         return filtered
@@ -322,11 +605,368 @@ def filter_subtitles_by_time(subtitles, start_time, end_time):
         logger.error(traceback.format_exc())
         return []
 
-def extract_segments(gpt_response, subtitle_file, video_url):
+def run_ffmpeg(ffmpeg_cmd):
+    """FFmpegを実行し、成功したかどうかを返す"""
+    # 進捗表示を抑制してエラーのみ出力させ、標準エラーはエラー時のみデコードする
+    ffmpeg_cmd = [ffmpeg_cmd[0], '-nostats', '-loglevel', 'error', *ffmpeg_cmd[1:]]
+    result = subprocess.run(ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        logger.error(f"FFmpeg error: {result.stderr.decode('utf-8', 'replace')}")
+        return False
+    return True
+
+def find_keyframes(video_path, start_seconds, end_seconds):
+    """区間内のキーフレームの(表示時刻, デコード時刻)の一覧と、映像ストリームの情報を取得（取得できない場合はNone）"""
+    ffprobe_cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=codec_name,profile,pix_fmt:packet=pts_time,dts_time,flags',
+        '-read_intervals', f"{start_seconds}%{end_seconds}",
+        '-of', 'json',
+        str(video_path)
+    ]
+    try:
+        result = subprocess.run(ffprobe_cmd, capture_output=True, text=True)
+    except OSError as e:
+        logger.error(f"Error running FFprobe: {e}")
+        return None, None
+    if result.returncode != 0:
+        logger.error(f"FFprobe error: {result.stderr}")
+        return None, None
+
+    try:
+        probe = json.loads(result.stdout)
+    except ValueError:
+        return None, None
+    streams = probe.get('streams') or [None]
+
+    keyframes = []
+    for packet in probe.get('packets', []):
+        if 'K' not in packet.get('flags', ''):
+            continue
+        try:
+            pts = float(packet['pts_time'])
+            dts = float(packet['dts_time'])
+        except (KeyError, ValueError):
+            continue
+        # シーク位置より前のキーフレームも出力されるため除外
+        if start_seconds - KEYFRAME_TOLERANCE <= pts <= end_seconds + KEYFRAME_TOLERANCE:
+            keyframes.append((pts, dts))
+    return keyframes, streams[0]
+
+def get_part_video_args(stream):
+    """端数部分の再エンコードを元動画と連結できる形式に合わせる引数を取得（合わせられない場合はNone）"""
+    # 連結後は最初の部分のSPSのみが使われるため、コーデック・プロファイル・画素形式が一致しない場合は連結しない
+    if not stream or stream.get('codec_name') != 'h264' or stream.get('pix_fmt') != 'yuv420p':
+        return None
+    profile = H264_PART_PROFILES.get(stream.get('profile'))
+    if profile is None:
+        return None
+    return ['-profile:v', profile, '-pix_fmt', 'yuv420p']
+
+def get_video_extradata(video_path):
+    """映像ストリームのextradata（H.264ではSPS/PPS）を取得（取得できない場合はNone）"""
+    ffprobe_cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_data',
+        '-show_entries', 'stream=extradata',
+        '-of', 'json',
+        str(video_path)
+    ]
+    try:
+        result = subprocess.run(ffprobe_cmd, capture_output=True, text=True)
+    except OSError as e:
+        logger.error(f"Error running FFprobe: {e}")
+        return None
+    if result.returncode != 0:
+        logger.error(f"FFprobe error: {result.stderr}")
+        return None
+
+    try:
+        streams = json.loads(result.stdout).get('streams') or [{}]
+    except ValueError:
+        return None
+    return streams[0].get('extradata') or None
+
+@lru_cache(maxsize=None)
+def detect_video_encoder():
+    """再エンコードに使用するH.264エンコーダーを検出（ハードウェアエンコーダーを優先）"""
+    try:
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'], capture_output=True, text=True)
+        available = result.stdout
+    except OSError as e:
+        logger.error(f"Error detecting FFmpeg encoders: {e}")
+        return SOFTWARE_VIDEO_ENCODER
+
+    for encoder, quality_args in HARDWARE_VIDEO_ENCODERS:
+        if not re.search(rf'\b{encoder}\b', available):
+            continue
+        # エンコーダーが組み込まれていてもデバイスがない場合があるため、短い映像で動作を確認
+        test_cmd = [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-f', 'lavfi', '-i', 'color=size=256x256:duration=0.1',
+            '-c:v', encoder, *quality_args,
+            '-f', 'null', '-'
+        ]
+        if subprocess.run(test_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0:
+            logger.info(f"Using hardware video encoder: {encoder}")
+            return encoder, quality_args
+
+    logger.info(f"Using software video encoder: {SOFTWARE_VIDEO_ENCODER[0]}")
+    return SOFTWARE_VIDEO_ENCODER
+
+def reencode_segment(video_path, start_seconds, duration, output_path, threads=0, video_args=(), audio=True):
+    """区間を高品質設定で再エンコードして切り出す（threadsが0の場合はFFmpegが自動で決定）"""
+    encoder, quality_args = detect_video_encoder()
+    audio_args = ['-c:a', 'aac', '-b:a', '192k'] if audio else ['-an']
+    return run_ffmpeg([
+        'ffmpeg',
+        '-ss', str(start_seconds),
+        '-i', str(video_path),
+        '-t', str(duration),
+        '-threads', str(threads),
+        '-c:v', encoder,
+        *quality_args,
+        *video_args,
+        *audio_args,
+        '-avoid_negative_ts', 'make_zero',
+        '-movflags', '+faststart',
+        '-y',
+        str(output_path)
+    ])
+
+def concat_file_entry(path):
+    """concatデマルチプレクサのリストに書き込むfile行を作成（パス中の'はエスケープする）"""
+    escaped = Path(path).resolve().as_posix().replace("'", "'\\''")
+    return f"file '{escaped}'"
+
+def reencode_part(video_path, start_seconds, duration, part_path, threads, video_args, source_extradata):
+    """端数部分の映像を再エンコードし、元動画とSPS/PPSが完全に一致して連結できるかを返す"""
+    if not reencode_segment(video_path, start_seconds, duration, part_path, threads, video_args, audio=False):
+        return False
+    # 連結後のMP4には最初の部分のSPS/PPSしか残らず、プロファイルが同じでもエントロピー符号化や
+    # 参照フレーム数などが異なるとコピー部分が壊れるため、一致しない場合は連結しない
+    if get_video_extradata(part_path) != source_extradata:
+        logger.info(f"Re-encoded part does not match the source parameter sets: {part_path.name}")
+        return False
+    return True
+
+def cut_segment(video_path, start_seconds, duration, output_path, threads=0):
+    """動画から指定区間を切り出す（可能な限りストリームコピーを使用）"""
+    if not FAST_CUT:
+        return reencode_segment(video_path, start_seconds, duration, output_path, threads)
+
+    end_seconds = start_seconds + duration
+    keyframes, stream = find_keyframes(video_path, start_seconds, end_seconds)
+    if not keyframes or len(keyframes) < 2:
+        # 区間内にストリームコピーできるGOPがない場合は区間全体を再エンコード
+        return reencode_segment(video_path, start_seconds, duration, output_path, threads)
+
+    # 最初のキーフレームから最後のキーフレームの直前までをストリームコピーし、前後の端数のみ映像を再エンコード
+    (first_keyframe, _), (last_keyframe, last_keyframe_dts) = keyframes[0], keyframes[-1]
+    has_head = first_keyframe - start_seconds > KEYFRAME_TOLERANCE
+    has_tail = end_seconds - last_keyframe > KEYFRAME_TOLERANCE
+    part_video_args = get_part_video_args(stream)
+    source_extradata = get_video_extradata(video_path) if has_head or has_tail else None
+    if (has_head or has_tail) and (part_video_args is None or source_extradata is None):
+        # 端数部分を元動画と同じ形式で再エンコードできない場合は区間全体を再エンコード
+        return reencode_segment(video_path, start_seconds, duration, output_path, threads)
+
+    head_path = output_path.with_suffix('.head.mp4')
+    tail_path = output_path.with_suffix('.tail.mp4')
+    video_list_path = output_path.with_suffix('.video.txt')
+    audio_list_path = output_path.with_suffix('.audio.txt')
+    try:
+        if ((not has_head or reencode_part(video_path, start_seconds, first_keyframe - start_seconds, head_path, threads, part_video_args, source_extradata))
+                and (not has_tail or reencode_part(video_path, last_keyframe, end_seconds - last_keyframe, tail_path, threads, part_video_args, source_extradata))):
+            # Bフレームを含む映像は表示順とデコード順が異なるため、コピー部分はデコード時刻で打ち切り、
+            # 後続の時刻は表示時刻の長さ（duration）でずらして、継ぎ目でフレームが重複・ずれないようにする
+            # （ffprobeの時刻は丸められているため、最後のキーフレームを含めないよう少し手前で打ち切る）
+            with open(video_list_path, 'w', encoding='utf-8') as f:
+                if has_head:
+                    f.write(f"{concat_file_entry(head_path)}\n")
+                f.write(f"{concat_file_entry(video_path)}\n")
+                f.write(f"inpoint {first_keyframe}\n")
+                f.write(f"outpoint {last_keyframe_dts - 0.001}\n")
+                f.write(f"duration {last_keyframe - first_keyframe}\n")
+                if has_tail:
+                    f.write(f"{concat_file_entry(tail_path)}\n")
+
+            # 音声は継ぎ目で途切れたりずれたりしないよう、元動画から区間全体を1つのストリームとしてコピー
+            with open(audio_list_path, 'w', encoding='utf-8') as f:
+                f.write(f"{concat_file_entry(video_path)}\n")
+                f.write(f"inpoint {start_seconds}\n")
+                f.write(f"outpoint {end_seconds}\n")
+
+            # 映像と音声はどちらも区間の開始位置を0とした時刻になっているため、そのまま使う
+            if run_ffmpeg([
+                'ffmpeg',
+                '-copyts',
+                '-f', 'concat',
+                '-safe', '0',
+                '-i', str(video_list_path),
+                '-f', 'concat',
+                '-safe', '0',
+                '-i', str(audio_list_path),
+                '-map', '0:v:0',
+                '-map', '1:a?',
+                # シーク位置のキーフレームからinpointまでの音声パケットを出力に含めない
+                '-copypriorss', '0',
+                '-c', 'copy',
+                '-movflags', '+faststart',
+                '-y',
+                str(output_path)
+            ]):
+                return True
+    except OSError as e:
+        logger.error(f"Error writing concat list: {e}")
+    finally:
+        for path in (head_path, tail_path, video_list_path, audio_list_path):
+            path.unlink(missing_ok=True)
+
+    # 高速な切り出しに失敗した場合もセグメントを落とさず、区間全体を再エンコードする
+    logger.warning(f"Fast cut failed, re-encoding segment {start_seconds} - {end_seconds}")
+    return reencode_segment(video_path, start_seconds, duration, output_path, threads)
+
+def normalize_score(field, value):
+    """評価値を1から10までの整数に正規化"""
+    try:
+        return int(round(max(1, min(10, float(value)))))
+    except (ValueError, TypeError):
+        logger.error(f"Invalid score value for {field}: {value}")
+        return 5
+
+def normalize_segment(segment):
+    """セグメントの必須フィールド・評価値・時間形式を検証して正規化（不正な場合はNone）"""
+    try:
+        # 必須フィールドの検証
+        if not all(field in segment for field in REQUIRED_SEGMENT_FIELDS):
+            logger.error(f"Missing required fields in segment: {segment}")
+            return None
+
+        # 時間形式の検証と正規化
+        start_time = segment['start'].strip()
+        end_time = segment['end'].strip()
+
+        # HH:MM:SS形式に正規化
+        start_match = TIME_RE.match(start_time)
+        end_match = TIME_RE.match(end_time)
+
+        if not (start_match and end_match):
+            logger.error(f"Invalid time format: start={start_time}, end={end_time}")
+            return None
+
+        # 時間を秒数に変換
+        start_seconds = int(start_match.group(1)) * 3600 + int(start_match.group(2)) * 60 + int(start_match.group(3))
+        end_seconds = int(end_match.group(1)) * 3600 + int(end_match.group(2)) * 60 + int(end_match.group(3))
+        if end_seconds <= start_seconds:
+            logger.error(f"Invalid time range: start={start_time}, end={end_time}")
+            return None
+
+        reason = str(segment['reason']).strip()
+        return {
+            # 正規化された時間形式
+            'start_time': f"{int(start_match.group(1)):02d}:{start_match.group(2)}:{start_match.group(3)}",
+            'end_time': f"{int(end_match.group(1)):02d}:{end_match.group(2)}:{end_match.group(3)}",
+            'start_seconds': start_seconds,
+            'end_seconds': end_seconds,
+            'title': segment.get('title'),
+            # 数値フィールドの検証と正規化
+            **{field: normalize_score(field, segment[field]) for field in SCORE_FIELDS},
+            'reason': reason if len(reason) >= 10 else "理由が十分に説明されていません。"
+        }
+    except Exception as e:
+        logger.error(f"Error validating segment: {e}")
+        return None
+
+def download_section(video_id, start_seconds, end_seconds, output_path):
+    """yt-dlpで動画の指定区間のみをダウンロード"""
+    ydl_opts = {
+        'format': VIDEO_FORMAT,
+        'merge_output_format': 'mp4',
+        'outtmpl': str(output_path),
+        'quiet': True,
+        'no_warnings': True,
+        'overwrites': True,
+        'download_ranges': download_range_func(None, [(start_seconds, end_seconds)]),
+        # 切り出し位置にキーフレームを挿入し、開始位置がずれないようにする
+        'force_keyframes_at_cuts': True
+    }
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            ydl.download([f"https://www.youtube.com/watch?v={video_id}"])
+        return output_path.exists()
+    except Exception as e:
+        logger.error(f"Error downloading section: {e}")
+        return False
+
+def process_segment(segment, temp_path, subtitle_index, video_id, video_title, job_token, ffmpeg_threads=0):
+    """正規化済みの1つのセグメントについて、字幕と動画を切り出す"""
+    # 同じ動画・区間のジョブが同時に実行されても互いの作業ファイルを壊さないよう、
+    # ジョブごとの名前で書き込んでから完成したファイルを置き換える
+    work_paths = []
+    try:
+        start_time = segment['start_time']
+        end_time = segment['end_time']
+        clip_name = f"clip_{video_id}_{start_time.replace(':', '_')}_{end_time.replace(':', '_')}"
+
+        # 指定された時間範囲の字幕を抽出
+        segment_subtitles = filter_subtitles_by_time(subtitle_index, start_time, end_time)
+
+        # 字幕ファイルを保存
+        segment_subtitle_path = DOWNLOADS_DIR / f"{clip_name}_subtitles.txt"
+        work_subtitle_path = DOWNLOADS_DIR / f"{clip_name}_subtitles.{job_token}.txt"
+        work_paths.append(work_subtitle_path)
+        with open(work_subtitle_path, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as f:
+            f.writelines(f"{line}\n" for line in segment_subtitles)
+
+        # セグメントの切り出し
+        output_path = DOWNLOADS_DIR / f"{clip_name}.mp4"
+        work_path = DOWNLOADS_DIR / f"{clip_name}.{job_token}.mp4"
+        work_paths.append(work_path)
+
+        if temp_path is None:
+            # 動画全体を使わず、この区間のみをダウンロード
+            logger.info(f"Downloading video section {start_time} - {end_time}...")
+            if not download_section(video_id, segment['start_seconds'], segment['end_seconds'], work_path):
+                return None
+        else:
+            # FFmpegで動画を切り出し
+            logger.info(f"Cutting video segment {start_time} - {end_time}...")
+            duration = segment['end_seconds'] - segment['start_seconds']
+            if not cut_segment(temp_path, segment['start_seconds'], duration, work_path, ffmpeg_threads):
+                return None
+
+        os.replace(work_subtitle_path, segment_subtitle_path)
+        os.replace(work_path, output_path)
+
+        return {
+            'start_time': start_time,
+            'end_time': end_time,
+            'video_title': video_title,
+            'subtitle_file': str(segment_subtitle_path),
+            'video_file': str(output_path),
+            'title': segment['title'],
+            **{field: segment[field] for field in SCORE_FIELDS},
+            'reason': segment['reason']
+        }
+
+    except Exception as e:
+        logger.error(f"Error processing segment: {e}")
+        logger.error(traceback.format_exc())
+        return None
+    finally:
+        for path in work_paths:
+            path.unlink(missing_ok=True)
+
+def extract_segments(gpt_response, subtitle_file, video_url, sid=None):
     """ChatGPTのレスポンスから動画セグメントを抽出"""
     try:
         # 進捗状況を0%に設定
-        socketio.emit('progress_update', {'task': 'video', 'progress': 0})
+        emit_progress(sid, 'video', 0)
         
         # JSONデータのパース
         segments = json.loads(gpt_response)
@@ -339,159 +979,111 @@ def extract_segments(gpt_response, subtitle_file, video_url):
             logger.error("Invalid video URL")
             return None
 
-        # 元の字幕ファイルを読み込む
-        with open(subtitle_file, 'r', encoding='utf-8') as f:
-            all_subtitles = f.read().splitlines()
-
-        # 動画全体を一度だけダウンロード
-        temp_filename = f"temp_{video_id}.mp4"
-        temp_path = DOWNLOADS_DIR / temp_filename
-
-        # yt-dlpのオプション設定
-        ydl_opts = {
-            'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo+bestaudio/best',
-            'outtmpl': str(temp_path),
-            'quiet': True,
-            'no_warnings': True,
-            'postprocessors': [{
-                'key': 'FFmpegVideoConvertor',
-                'preferedformat': 'mp4'
-            }],
-            'merge_output_format': 'mp4'
-        }
+        # 全セグメントを先に検証し、有効なセグメントがなければ動画をダウンロードしない
+        valid_segments = [
+            (i, normalized)
+            for i, normalized in enumerate(map(normalize_segment, segments))
+            if normalized
+        ]
+        if not valid_segments:
+            logger.error("No valid segments found")
+            return None
+
+        # 同じ区間のセグメントは出力ファイルが同じになり、並列に書き込むと壊れるため最初の1つのみ処理する
+        seen_ranges = set()
+        unique_segments = []
+        for i, segment in valid_segments:
+            segment_range = (segment['start_seconds'], segment['end_seconds'])
+            if segment_range in seen_ranges:
+                logger.warning(f"Skipping duplicate segment {segment['start_time']} - {segment['end_time']}")
+                continue
+            seen_ranges.add(segment_range)
+            unique_segments.append((i, segment))
+        valid_segments = unique_segments
+
+        # 字幕取得結果のキャッシュにある同じ字幕ファイルの内容を優先し、なければ元の字幕ファイルを読み込む
+        cached = process_cache.get(video_id)
+        if cached and cached[2] == str(subtitle_file):
+            subtitles = cached[0]
+        else:
+            with open(subtitle_file, 'r', encoding='utf-8') as f:
+                subtitles = f.read()
+
+        # 全セグメントで共有する字幕の検索用インデックスを一度だけ作成
+        subtitle_index = build_subtitle_index(subtitles)
+
+        # 同じ動画のジョブが同時に実行されても作業ファイルを共有しないよう、ジョブごとの識別子を付ける
+        job_token = uuid.uuid4().hex
 
-        # 動画全体をダウンロード（まだ存在しない場合のみ）
-        if not temp_path.exists():
-            logger.info("Downloading full video in highest quality...")
+        if DOWNLOAD_SECTIONS:
+            # 動画全体はダウンロードせず、各セグメントの区間のみをダウンロードする
+            temp_path = None
+        else:
+            # 動画全体を一度だけダウンロード
+            temp_filename = f"temp_{video_id}_{job_token}.mp4"
+            temp_path = DOWNLOADS_DIR / temp_filename
+
+            # yt-dlpのオプション設定
+            # 映像と音声の結合はストリームコピーのみで行い、再エンコードを伴う変換処理は使用しない
+            ydl_opts = {
+                'format': VIDEO_FORMAT,
+                'merge_output_format': 'mp4',
+                'outtmpl': str(temp_path),
+                'quiet': True,
+                'no_warnings': True,
+                'concurrent_fragment_downloads': 8
+            }
+
+            # 動画全体をダウンロード
+            logger.info("Downloading full video...")
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 ydl.download([f"https://www.youtube.com/watch?v={video_id}"])
         
-        socketio.emit('progress_update', {'task': 'video', 'progress': 40})
+        emit_progress(sid, 'video', 40)
+
+        total_segments = len(valid_segments)
+        completed = 0
+        results_by_index = {}
+
+        video_title = os.path.basename(str(subtitle_file)).replace(f"_{video_id}_subtitles.txt", '')
+
+        # 各セグメントは同じ一時ファイルを読み込むだけ（または個別にダウンロードする）なので並列に処理
+        cpu_count = os.cpu_count() or 1
+        max_workers = min(total_segments, cpu_count)
+        # 同時に実行するFFmpegでCPUコアを分け合い、エンコードスレッドの奪い合いを避ける
+        ffmpeg_threads = max(1, cpu_count // max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(process_segment, segment, temp_path, subtitle_index, video_id, video_title, job_token, ffmpeg_threads): i
+                for i, segment in valid_segments
+            }
+            for future in as_completed(futures):
+                result = future.result()
+                if result:
+                    results_by_index[futures[future]] = result
 
-        results = []
-        total_segments = len(segments)
-        for i, segment in enumerate(segments, 1):
-            try:
                 # 進捗状況を更新（40%から90%の間で分配）
-                progress = 40 + (50 * i / total_segments)
-                socketio.emit('progress_update', {'task': 'video', 'progress': int(progress)})
-                
-                # 必須フィールドの検証
-                required_fields = ['start', 'end', 'impact', 'uniqueness', 'timeliness', 'entertainment', 'reason']
-                if not all(field in segment for field in required_fields):
-                    logger.error(f"Missing required fields in segment: {segment}")
-                    continue
-
-                # 数値フィールドの検証と正規化
-                score_fields = ['impact', 'uniqueness', 'timeliness', 'entertainment']
-                normalized_scores = {}
-                for field in score_fields:
-                    try:
-                        score = float(segment[field])
-                        if not (1 <= score <= 10):
-                            score = max(1, min(10, score))
-                        normalized_scores[field] = int(round(score))
-                    except (ValueError, TypeError):
-                        logger.error(f"Invalid score value for {field}: {segment[field]}")
-                        normalized_scores[field] = 5
-
-                # 時間形式の検証と正規化
-                try:
-                    start_time = segment['start'].strip()
-                    end_time = segment['end'].strip()
-                    
-                    # HH:MM:SS形式に正規化
-                    time_pattern = re.compile(r'^(\d{1,2}):?(\d{2}):?(\d{2})$')
-                    
-                    start_match = time_pattern.match(start_time)
-                    end_match = time_pattern.match(end_time)
-                    
-                    if not (start_match and end_match):
-                        logger.error(f"Invalid time format: start={start_time}, end={end_time}")
-                        continue
-                    
-                    # 正規化された時間形式
-                    start_time = f"{int(start_match.group(1)):02d}:{start_match.group(2)}:{start_match.group(3)}"
-                    end_time = f"{int(end_match.group(1)):02d}:{end_match.group(2)}:{end_match.group(3)}"
-
-                    # 時間を秒数に変換
-                    def time_to_seconds(time_str):
-                        h, m, s = map(int, time_str.split(':'))
-                        return h * 3600 + m * 60 + s
-
-                    start_seconds = time_to_seconds(start_time)
-                    end_seconds = time_to_seconds(end_time)
-                    duration = end_seconds - start_seconds
-
-                    # 指定された時間範囲の字幕を抽出
-                    segment_subtitles = filter_subtitles_by_time(all_subtitles, start_time, end_time)
-                    
-                    # 字幕ファイルを保存
-                    segment_subtitle_filename = f"clip_{video_id}_{start_time.replace(':', '_')}_{end_time.replace(':', '_')}_subtitles.txt"
-                    segment_subtitle_path = DOWNLOADS_DIR / segment_subtitle_filename
-                    with open(segment_subtitle_path, 'w', encoding='utf-8') as f:
-                        f.write('\n'.join(segment_subtitles))
-
-                    # セグメントの切り出し
-                    output_filename = f"clip_{video_id}_{start_time.replace(':', '_')}_{end_time.replace(':', '_')}.mp4"
-                    output_path = DOWNLOADS_DIR / output_filename
-
-                    # FFmpegで動画を切り出し（高品質設定）
-                    logger.info(f"Cutting video segment {start_time} - {end_time} with high quality settings...")
-                    ffmpeg_cmd = [
-                        'ffmpeg',
-                        '-i', str(temp_path),
-                        '-ss', str(start_seconds),
-                        '-t', str(duration),
-                        '-c:v', 'libx264',
-                        '-preset', 'slow',
-                        '-crf', '18',
-                        '-c:a', 'aac',
-                        '-b:a', '192k',
-                        '-avoid_negative_ts', '1',
-                        '-y',
-                        str(output_path)
-                    ]
-
-                    result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
-                    if result.returncode != 0:
-                        logger.error(f"FFmpeg error: {result.stderr}")
-                        continue
-
-                    results.append({
-                        'start_time': start_time,
-                        'end_time': end_time,
-                        'video_title': os.path.basename(str(subtitle_file)).replace('_subtitles.txt', ''),
-                        'subtitle_file': str(segment_subtitle_path),
-                        'video_file': str(output_path),
-                        'title': segment.get('title', f'切り抜き {len(results) + 1}'),
-                        'impact': normalized_scores['impact'],
-                        'uniqueness': normalized_scores['uniqueness'],
-                        'timeliness': normalized_scores['timeliness'],
-                        'entertainment': normalized_scores['entertainment'],
-                        'reason': str(segment['reason']).strip() if len(str(segment['reason']).strip()) >= 10 else "理由が十分に説明されていません。"
-                    })
-
-                except Exception as e:
-                    logger.error(f"Error processing time format: {e}")
-                    continue
+                completed += 1
+                progress = 40 + (50 * completed / total_segments)
+                emit_progress(sid, 'video', progress)
 
-            except Exception as e:
-                logger.error(f"Error processing segment: {e}")
-                logger.error(traceback.format_exc())
-                continue
+        # 元のセグメント順に並べ、タイトルがない場合は連番を付ける
+        results = [results_by_index[i] for i in sorted(results_by_index)]
+        for i, result in enumerate(results, 1):
+            if result['title'] is None:
+                result['title'] = f'切り抜き {i}'
 
         # 全てのセグメントの処理が完了したら一時ファイルを削除
-        if temp_path.exists():
+        if temp_path:
             logger.info("Cleaning up temporary file...")
-            temp_path.unlink()
+            temp_path.unlink(missing_ok=True)
 
         if not results:
             logger.error("No valid segments found")
             return None
 
         # 進捗状況を100%に設定
-        socketio.emit('progress_update', {'task': 'video', 'progress': 100})
+        emit_progress(sid, 'video', 100)
         return results
 
     except json.JSONDecodeError as e:
@@ -501,630 +1093,224 @@ def extract_segments(gpt_response, subtitle_file, video_url):
         logger.error(f"Unexpected error in extract_segments: {e}")
         logger.error(traceback.format_exc())
         # エラーが発生した場合も一時ファイルを削除
-        if 'temp_path' in locals() and temp_path.exists():
-            temp_path.unlink()
+        if locals().get('temp_path'):
+            temp_path.unlink(missing_ok=True)
         return None
 
+def precompress(body):
+    """配信する内容を事前に圧縮し、形式ごとの内容とETagを返す"""
+    variants = {
+        'br': brotli.compress(body, quality=11),
+        'gzip': gzip.compress(body, compresslevel=9),
+        'identity': body
+    }
+    return variants, hashlib.sha1(body).hexdigest()
+
+def make_precompressed_response(asset, mimetype, max_age):
+    """事前に圧縮した内容から、クライアントが対応する形式でレスポンスを作成"""
+    variants, etag = asset
+    encoding = next((e for e in ('br', 'gzip') if request.accept_encodings[e]), 'identity')
+
+    response = Response(variants[encoding], mimetype=mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # 圧縮形式ごとに内容が異なるため、ETagも形式ごとに分ける
+    response.set_etag(f"{etag}-{encoding}")
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response.make_conditional(request)
+
+@lru_cache(maxsize=1)
+def load_static_assets():
+    """静的ファイルを一度だけ読み込んで圧縮し、内容のハッシュを含む配信名を付ける"""
+    assets = {}
+    urls = {}
+    for name, mimetype in STATIC_ASSETS.items():
+        with open(os.path.join(app.static_folder, name), 'rb') as f:
+            asset = precompress(f.read())
+        stem, ext = os.path.splitext(name)
+        fingerprinted = f"{stem}.{asset[1][:12]}{ext}"
+        assets[fingerprinted] = (asset, mimetype)
+        urls[name] = f"/assets/{fingerprinted}"
+    return assets, urls
+
+def asset_url(name):
+    """静的ファイルの配信URLを取得"""
+    return load_static_assets()[1][name]
+
+@lru_cache(maxsize=1)
+def render_index_page():
+    """メインページを一度だけ描画して圧縮"""
+    return precompress(render_template('index.html', asset_url=asset_url).encode('utf-8'))
+
 @app.route('/')
 def index():
     """メインページのHTML"""
-    return """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>YouTube Live Clipper</title>
-        <meta charset="utf-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1">
-        <link href="https://fonts.googleapis.com/css2?family=Noto+Sans+JP:wght@400;500;700&display=swap" rel="stylesheet">
-        <style>
-            :root {
-                --primary-color: #FF8A8A;
-                --background-color: #F4F5F7;
-                --accent-light: #F0EAAC;
-                --accent-dark: #CCE0AC;
-                --text-color: #2D3436;
-                --shadow-color: rgba(0, 0, 0, 0.1);
-                --neu-light: #FFFFFF;
-                --neu-dark: rgba(0, 0, 0, 0.1);
-                --button-primary: #4A90E2;
-                --button-secondary: #82B1FF;
-            }
-
-            body {
-                font-family: 'Noto Sans JP', sans-serif;
-                line-height: 1.6;
-                color: var(--text-color);
-                background: var(--background-color);
-                padding: 2rem;
-                min-height: 100vh;
-            }
-
-            .button-group {
-                display: flex;
-                gap: 1rem;
-                margin-top: 1.5rem;
-            }
-
-            .download-button {
-                padding: 0.8rem 1.5rem;
-                border: none;
-                border-radius: 12px;
-                background: var(--button-primary);
-                color: white;
-                font-weight: 600;
-                text-decoration: none;
-                display: inline-flex;
-                align-items: center;
-                gap: 0.5rem;
-                transition: all 0.3s ease;
-                box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-            }
-
-            .download-button:hover {
-                transform: translateY(-2px);
-                box-shadow: 0 6px 8px rgba(0, 0, 0, 0.15);
-            }
-
-            .download-button.secondary {
-                background: var(--button-secondary);
-            }
-
-            .card {
-                background: white;
-                border-radius: 20px;
-                padding: 2rem;
-                margin-bottom: 2rem;
-                box-shadow: 0 8px 16px rgba(0, 0, 0, 0.1);
-            }
-
-            .card-title {
-                color: var(--primary-color);
-                font-size: 1.5rem;
-                margin-bottom: 1rem;
-                font-weight: 600;
-            }
-
-            .time-info {
-                background: var(--accent-light);
-                padding: 0.5rem 1rem;
-                border-radius: 8px;
-                display: inline-block;
-                margin-bottom: 1rem;
-            }
-
-            .scores {
-                display: flex;
-                flex-wrap: wrap;
-                gap: 0.8rem;
-                margin: 1rem 0;
-            }
-
-            .score-badge {
-                padding: 0.5rem 1rem;
-                border-radius: 8px;
-                font-weight: 500;
-                background: var(--accent-dark);
-                color: var(--text-color);
-            }
-
-            .container {
-                max-width: 1200px;
-                margin: 0 auto;
-                padding: 2rem;
-                position: relative;
-            }
-
-            .copyright {
-                position: fixed;
-                bottom: 1rem;
-                right: 1rem;
-                font-size: 0.8rem;
-                color: var(--text-color);
-                opacity: 0.7;
-            }
-
-            .neu-box {
-                border-radius: 25px;
-                background: rgba(255, 255, 255, 0.9);
-                box-shadow: 8px 8px 16px var(--neu-dark),
-                           -8px -8px 16px var(--neu-light);
-                padding: 2.5rem;
-                margin: 0 auto 2.5rem;
-                max-width: calc(100% - 5rem);  /* コンテナの左右マージンを考慮 */
-                transition: all 0.3s ease;
-            }
-
-            .prompt-container {
-                max-height: 400px;
-                overflow-y: auto;
-                padding: 1rem;
-                border-radius: 15px;
-                background: rgba(255, 255, 255, 0.8);
-                margin-bottom: 1rem;
-            }
-
-            .chatgpt-link {
-                display: inline-block;
-                margin-bottom: 1rem;
-                color: var(--primary-color);
-                text-decoration: none;
-                font-weight: 600;
-                transition: all 0.3s ease;
-            }
-
-            .chatgpt-link:hover {
-                color: var(--accent-color);
-                transform: translateY(-2px);
-            }
-
-            .loading {
-                display: none;
-                text-align: center;
-                margin: 2rem 0;
-            }
-
-            .loading-spinner {
-                width: 60px;
-                height: 60px;
-                border: 5px solid var(--secondary-color);
-                border-top: 5px solid var(--primary-color);
-                border-radius: 50%;
-                animation: spin 1s linear infinite;
-                margin: 0 auto;
-            }
-
-            .loading-text {
-                margin-top: 1rem;
-                color: var(--text-color);
-                font-weight: 500;
-            }
-
-            .progress-container {
-                width: 100%;
-                height: 4px;
-                background: var(--secondary-color);
-                margin-top: 1rem;
-                border-radius: 2px;
-                overflow: hidden;
-            }
-
-            .progress-bar {
-                height: 100%;
-                width: 0;
-                background: var(--primary-color);
-                transition: width 0.3s ease;
-            }
-
-            @keyframes spin {
-                0% { transform: rotate(0deg); }
-                100% { transform: rotate(360deg); }
-            }
-
-            @keyframes pulse {
-                0% { transform: scale(1); }
-                50% { transform: scale(1.05); }
-                100% { transform: scale(1); }
-            }
-
-            .processing {
-                animation: pulse 2s infinite;
-            }
-
-            .neu-input {
-                width: 100%;
-                padding: 1.2rem;
-                border: none;
-                border-radius: 15px;
-                background: var(--background-color);
-                box-shadow: inset 6px 6px 12px var(--neu-dark),
-                          inset -6px -6px 12px var(--neu-light);
-                color: var(--text-color);
-                font-size: 1.1rem;
-                margin-bottom: 1.5rem;
-                transition: all 0.3s ease;
-                box-sizing: border-box;  /* パディングを幅に含める */
-            }
-
-            textarea.neu-input {
-                min-height: 200px;
-                resize: vertical;
-                width: 100%;
-                display: block;
-                margin: 1.5rem 0;
-            }
-
-            .neu-button {
-                padding: 1.2rem 2.5rem;
-                border: none;
-                border-radius: 15px;
-                background: linear-gradient(145deg, var(--background-color), var(--neu-light));
-                box-shadow: 8px 8px 16px var(--neu-dark),
-                          -8px -8px 16px var(--neu-light);
-                color: var(--primary-color);
-                font-size: 1.1rem;
-                font-weight: 600;
-                cursor: pointer;
-                transition: all 0.3s ease;
-                margin: 1.5rem 0;
-                position: relative;
-                overflow: hidden;
-            }
-
-            .neu-button:hover {
-                box-shadow: 6px 6px 12px var(--neu-dark),
-                          -6px -6px 12px var(--neu-light);
-                transform: translateY(-2px);
-                color: var(--primary-hover);
-            }
-
-            .neu-button:active {
-                box-shadow: inset 6px 6px 12px var(--neu-dark),
-                          inset -6px -6px 12px var(--neu-light);
-                transform: translateY(0);
-            }
-
-            .error-message {
-                display: none;
-                color: var(--danger-color);
-                background: var(--background-color);
-                box-shadow: inset 6px 6px 12px var(--neu-dark),
-                          inset -6px -6px 12px var(--neu-light);
-                border-radius: 15px;
-                padding: 1.2rem;
-                margin: 1.5rem 0;
-                font-size: 1rem;
-            }
+    return make_precompressed_response(render_index_page(), 'text/html', INDEX_MAX_AGE)
+
+@app.route('/assets/<name>')
+def static_asset(name):
+    """静的ファイルの配信"""
+    entry = load_static_assets()[0].get(name)
+    if entry is None:
+        return jsonify({'error': 'ファイルが見つかりません。'}), 404
+
+    asset, mimetype = entry
+    response = make_precompressed_response(asset, mimetype, ASSET_MAX_AGE)
+    # 内容が変わると配信名も変わるため、再検証なしでキャッシュさせる
+    response.cache_control.immutable = True
+    return response
+
+def process_job(sid, url):
+    """字幕取得とプロンプト生成を実行"""
+    # 同じ動画の字幕取得結果がキャッシュにあれば再利用
+    video_id = extract_video_id(url)
+    cached = load_process_result(video_id) if video_id else None
+    if cached:
+        logger.info(f"Using cached subtitles for {video_id}")
+        subtitles, video_title, subtitle_file = cached
+    else:
+        # 動画情報と字幕を取得
+        subtitles, error, video_title, subtitle_file = download_video_and_subtitles(url, sid)
+        if error:
+            return {'error': error}
+        save_process_result(video_id, subtitles, video_title, subtitle_file)
 
-            .results {
-                margin-top: 3rem;
-            }
-
-            .clip-item {
-                margin-bottom: 2.5rem;
-                transition: all 0.3s ease;
-                border-radius: 20px;
-                padding: 2rem;
-                background: var(--background-color);
-                box-shadow: 8px 8px 16px var(--neu-dark),
-                          -8px -8px 16px var(--neu-light);
-            }
-
-            .clip-item:hover {
-                transform: translateY(-3px);
-                box-shadow: 10px 10px 20px var(--neu-dark),
-                          -10px -10px 20px var(--neu-light);
-            }
-
-            .copy-button {
-                background: var(--background-color);
-                border: none;
-                border-radius: 12px;
-                padding: 0.8rem 1.5rem;
-                color: var(--primary-color);
-                font-weight: 600;
-                cursor: pointer;
-                box-shadow: 6px 6px 12px var(--neu-dark),
-                          -6px -6px 12px var(--neu-light);
-                transition: all 0.3s ease;
-            }
-
-            .copy-button:hover {
-                transform: translateY(-2px);
-                box-shadow: 8px 8px 16px var(--neu-dark),
-                          -8px -8px 16px var(--neu-light);
-            }
-
-            .copy-button:active {
-                transform: translateY(0);
-                box-shadow: inset 4px 4px 8px var(--neu-dark),
-                          inset -4px -4px 8px var(--neu-light);
-            }
+    # プロンプトを生成
+    prompt = create_gpt_prompt(subtitles, video_title)
 
-            /* 入力フォームのコンテナスタイルを追加 */
-            .input-container {
-                width: 100%;
-                max-width: calc(100% - 5rem);  /* コンテナの左右マージンを考慮 */
-                margin: 0 auto;
-            }
+    # 字幕ファイルと動画URLはサーバー側に保持し、クライアントにはセッションIDのみを渡す
+    session_id = uuid.uuid4().hex
+    sessions.set(session_id, (subtitle_file, url))
 
-            .video-processing {
-                margin-top: 1.5rem;
-                text-align: center;
-            }
+    return {
+        'success': True,
+        'prompt': prompt,
+        'video_title': video_title,
+        'session_id': session_id
+    }
 
-            .video-processing .loading-text {
-                margin: 1rem 0;
-                color: var(--text-color);
-                font-weight: 500;
-            }
+def extract_job(sid, gpt_response, subtitle_file, video_url):
+    """ChatGPTの応答からセグメントを切り出す"""
+    segments = extract_segments(gpt_response, subtitle_file, video_url, sid=sid)
+    if segments is None:
+        return {'error': 'セグメントの抽出に失敗しました。'}
 
-            .video-processing .progress-container {
-                width: 100%;
-                height: 4px;
-                background: var(--secondary-color);
-                margin-top: 0.5rem;
-                border-radius: 2px;
-                overflow: hidden;
-            }
+    # セグメントのカードはサーバー側でまとめて描画し、クライアントは一度挿入するだけにする
+    with app.app_context():
+        segments_html = render_template('_segment_card.html', segments=segments)
 
-            .video-processing .progress-bar {
-                height: 100%;
-                width: 0;
-                background: var(--primary-color);
-                transition: width 0.3s ease;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>YouTube Live Clipper</h1>
-            
-            <div class="neu-box">
-                <form id="urlForm">
-                    <input type="text" name="url" class="neu-input" placeholder="YouTube URLを入力してください" required>
-                    <button type="submit" class="neu-button">字幕を取得</button>
-                </form>
-            </div>
-
-            <div class="loading">
-                <div class="loading-spinner"></div>
-                <p class="loading-text">処理中...</p>
-                <div class="progress-container">
-                    <div class="progress-bar"></div>
-                </div>
-            </div>
-
-            <div id="resultCard" class="neu-box" style="display: none;">
-                <h2>ChatGPT用プロンプト</h2>
-                <a href="https://chat.openai.com/" target="_blank" class="chatgpt-link">ChatGPTで開く →</a>
-                <div class="prompt-container">
-                    <pre id="promptResult" style="white-space: pre-wrap;"></pre>
-                </div>
-                <button onclick="copyToClipboard()" class="copy-button">コピー</button>
-            </div>
-
-            <div id="gptResponseCard" class="neu-box" style="display: none;">
-                <h2>ChatGPTの応答を入力</h2>
-                <div class="input-container">
-                    <textarea id="gptResponseInput" class="neu-input" placeholder="ChatGPTの応答をここに貼り付けてください"></textarea>
-                    <button onclick="processGptResponse()" class="neu-button">セグメントを抽出</button>
-                    <div class="video-processing" style="display: none;">
-                        <p class="loading-text">動画を処理中...</p>
-                        <div class="progress-container">
-                            <div class="progress-bar"></div>
-                        </div>
-                    </div>
-                </div>
-            </div>
-
-            <div id="segmentsContainer"></div>
-            
-            <div class="copyright">© 2025, RegenRaum, SatsukiRain</div>
-        </div>
-
-        <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.0.1/socket.io.js"></script>
-        <script>
-            let currentVideoUrl = '';
-            let currentSubtitleFile = '';
-            let processingState = '';
-            let socket = io();
-
-            // WebSocketからの進捗状況更新を処理
-            socket.on('progress_update', function(data) {
-                const loading = document.querySelector('.loading');
-                const videoProcessing = document.querySelector('.video-processing');
-                
-                if (data.task === 'subtitles') {
-                    // 字幕取得の進捗を更新
-                    loading.style.display = 'block';
-                    const progressBar = loading.querySelector('.progress-bar');
-                    const loadingText = loading.querySelector('.loading-text');
-                    
-                    loadingText.textContent = `字幕を取得中... ${data.progress}%`;
-                    progressBar.style.width = `${data.progress}%`;
-                } else if (data.task === 'video') {
-                    // 動画処理の進捗を更新
-                    videoProcessing.style.display = 'block';
-                    const progressBar = videoProcessing.querySelector('.progress-bar');
-                    const loadingText = videoProcessing.querySelector('.loading-text');
-                    
-                    loadingText.textContent = `動画を処理中... ${data.progress}%`;
-                    progressBar.style.width = `${data.progress}%`;
-                }
-            });
-
-            function updateProgress(state, percent) {
-                const loading = document.querySelector('.loading');
-                loading.style.display = 'block';
-            }
+    return {
+        'success': True,
+        'segments': segments,
+        'segments_html': segments_html
+    }
 
-            document.getElementById('urlForm').addEventListener('submit', async (e) => {
-                e.preventDefault();
-                
-                const loading = document.querySelector('.loading');
-                const resultCard = document.getElementById('resultCard');
-                const gptResponseCard = document.getElementById('gptResponseCard');
-                const promptResult = document.getElementById('promptResult');
-                const segmentsContainer = document.getElementById('segmentsContainer');
-                
-                loading.style.display = 'block';
-                resultCard.style.display = 'none';
-                gptResponseCard.style.display = 'none';
-                segmentsContainer.innerHTML = '';
-                
-                try {
-                    const formData = new FormData(e.target);
-                    currentVideoUrl = formData.get('url');
-                    
-                    const response = await fetch('/process', {
-                        method: 'POST',
-                        body: formData
-                    });
-                    
-                    const data = await response.json();
-                    
-                    if (data.error) {
-                        alert(data.error);
-                        return;
-                    }
-                    
-                    currentSubtitleFile = data.subtitle_file;
-                    promptResult.textContent = data.prompt;
-                    resultCard.style.display = 'block';
-                    gptResponseCard.style.display = 'block';
-                } catch (error) {
-                    alert('エラーが発生しました: ' + error.message);
-                } finally {
-                    loading.style.display = 'none';
-                }
-            });
-
-            async function processGptResponse() {
-                const videoProcessing = document.querySelector('.video-processing');
-                const segmentsContainer = document.getElementById('segmentsContainer');
-                const gptResponse = document.getElementById('gptResponseInput').value;
-                
-                if (!gptResponse) {
-                    alert('ChatGPTの応答を入力してください。');
-                    return;
-                }
-                
-                videoProcessing.style.display = 'block';
-                
-                try {
-                    const response = await fetch('/extract', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json'
-                        },
-                        body: JSON.stringify({
-                            gpt_response: gptResponse,
-                            video_url: currentVideoUrl,
-                            subtitle_file: currentSubtitleFile
-                        })
-                    });
-                    
-                    const data = await response.json();
-                    
-                    if (data.error) {
-                        alert(data.error);
-                        return;
-                    }
-                    
-                    segmentsContainer.innerHTML = '';
-                    data.segments.forEach((segment, index) => {
-                        const card = document.createElement('div');
-                        card.className = 'card segment-card';
-                        
-                        // ファイル名の取得
-                        const subtitleFileName = segment.subtitle_file.split('/').pop();
-                        const videoFileName = segment.video_file.split('/').pop();
-                        
-                        card.innerHTML = `
-                            <div class="card-body">
-                                <h5 class="card-title">${segment.title}</h5>
-                                <p class="time-info">⏱ ${segment.start_time} - ${segment.end_time}</p>
-                                <div class="scores">
-                                    <span class="score-badge">インパクト: ${segment.impact}</span>
-                                    <span class="score-badge">独自性: ${segment.uniqueness}</span>
-                                    <span class="score-badge">時事性: ${segment.timeliness}</span>
-                                    <span class="score-badge">エンターテイメント性: ${segment.entertainment}</span>
-                                </div>
-                                <p class="card-text">${segment.reason}</p>
-                                <div class="button-group">
-                                    <a href="/download/subtitle/${encodeURIComponent(subtitleFileName)}" 
-                                       class="download-button secondary" 
-                                       download="${subtitleFileName}">
-                                       <span>📝</span>字幕をダウンロード
-                                    </a>
-                                    <a href="/download/video/${encodeURIComponent(videoFileName)}" 
-                                       class="download-button" 
-                                       download="${videoFileName}">
-                                       <span>🎬</span>動画をダウンロード
-                                    </a>
-                                </div>
-                            </div>
-                        `;
-                        segmentsContainer.appendChild(card);
-                    });
-                } catch (error) {
-                    alert('エラーが発生しました: ' + error.message);
-                } finally {
-                    videoProcessing.style.display = 'none';
-                }
-            }
+def run_job(job_id, sid, job_func, *args):
+    """ジョブを実行し、結果をクライアントに通知"""
+    try:
+        result = job_func(sid, *args)
+    except Exception as e:
+        logger.error(f"Error in job {job_id}: {e}")
+        logger.error(traceback.format_exc())
+        result = {'error': f"エラーが発生しました: {str(e)}"}
+    # 失敗や途中終了で100%まで進まなかった場合も、記録が残り続けないようにする
+    clear_progress(sid)
+    if sid is None:
+        # 宛先を指定せずに送信すると全クライアントに届いてしまうため、通知しない
+        logger.error(f"No client to notify for job {job_id}")
+        return
+    socketio.emit('job_done', {'job_id': job_id, **result}, to=sid)
+
+def get_client_sid(data):
+    """リクエストで指定されたSocket.IOのsidを取得（接続中のクライアントでない場合はNone）"""
+    sid = data.get('sid')
+    if not isinstance(sid, str) or not socketio.server.manager.is_connected(sid, '/'):
+        return None
+    return sid
 
-            function copyToClipboard() {
-                const promptResult = document.getElementById('promptResult');
-                navigator.clipboard.writeText(promptResult.textContent)
-                    .then(() => {
-                        const copyButton = document.querySelector('.copy-button');
-                        copyButton.textContent = 'コピーしました！';
-                        setTimeout(() => {
-                            copyButton.textContent = 'コピー';
-                        }, 2000);
-                    })
-                    .catch(err => alert('コピーに失敗しました: ' + err));
-            }
-        </script>
-    </body>
-    </html>
-    """
+def start_job(sid, job_func, *args):
+    """ジョブをバックグラウンドで開始し、ジョブIDを返す"""
+    job_id = uuid.uuid4().hex
+    job_executor.submit(run_job, job_id, sid, job_func, *args)
+    return job_id
 
 @app.route('/process', methods=['POST'])
 def process_url():
-    url = request.form.get('url')
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'URLが提供されていません。'})
+    url = data.get('url')
     if not url:
         return jsonify({'error': 'URLが提供されていません。'})
+
+    sid = get_client_sid(data)
+    if sid is None:
+        return jsonify({'error': 'サーバーとの接続が確立されていません。ページを再読み込みしてください。'}), 400
     
-    # 動画情報と字幕を取得
-    subtitles, error, video_title, subtitle_file = download_video_and_subtitles(url)
-    if error:
-        return jsonify({'error': error})
-    
-    # プロンプトを生成
-    prompt = create_gpt_prompt(subtitles, video_title)
+    # 字幕取得はバックグラウンドで行い、結果はWebSocket経由で通知する
+    job_id = start_job(sid, process_job, url)
     
     return jsonify({
         'success': True,
-        'prompt': prompt,
-        'video_title': video_title,
-        'subtitle_file': subtitle_file
-    })
+        'job_id': job_id
+    }), 202
+
+@app.route('/cache/clear', methods=['POST'])
+def clear_cache():
+    """字幕取得結果のキャッシュを削除"""
+    process_cache.clear()
+    fetch_video_title.cache_clear()
+    extract_video_info.cache_clear()
+    for meta_path in DOWNLOADS_DIR.glob('*.meta.json'):
+        meta_path.unlink(missing_ok=True)
+    logger.info("Cleared process cache")
+    return jsonify({'success': True})
 
 @app.route('/extract', methods=['POST'])
 def extract_clips():
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': '必要な情報が不足しています。'})
     gpt_response = data.get('gpt_response')
-    video_url = data.get('video_url')
-    subtitle_file = data.get('subtitle_file')
+    session_id = data.get('session_id')
     
-    if not all([gpt_response, video_url, subtitle_file]):
+    # 文字列以外の値はセッションの検索や応答の解析に使えないため、不足として扱う
+    if not all(isinstance(value, str) and value for value in (gpt_response, session_id)):
         return jsonify({'error': '必要な情報が不足しています。'})
+
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({'error': 'セッションの有効期限が切れました。もう一度字幕を取得してください。'})
+    subtitle_file, video_url = session
+
+    sid = get_client_sid(data)
+    if sid is None:
+        return jsonify({'error': 'サーバーとの接続が確立されていません。ページを再読み込みしてください。'}), 400
     
-    segments = extract_segments(gpt_response, subtitle_file, video_url)
-    if segments is None:
-        return jsonify({'error': 'セグメントの抽出に失敗しました。'})
+    # 動画の切り出しはバックグラウンドで行い、結果はWebSocket経由で通知する
+    job_id = start_job(sid, extract_job, gpt_response, subtitle_file, video_url)
     
     return jsonify({
         'success': True,
-        'segments': segments
-    })
+        'job_id': job_id
+    }), 202
 
 @app.route('/download/subtitle/<path:filename>')
 def download_subtitle(filename):
     """字幕ファイルのダウンロード"""
     try:
-        file_path = DOWNLOADS_DIR / filename
-        if not file_path.exists():
-            return jsonify({'error': 'ファイルが見つかりません。'}), 404
-
-        return send_file(
-            file_path,
+        # safe_joinでdownloadsフォルダ外へのパス指定を拒否する
+        return send_from_directory(
+            DOWNLOADS_DIR,
+            filename,
             as_attachment=True,
             download_name=filename,
             mimetype='text/plain'
         )
+    except NotFound:
+        return jsonify({'error': 'ファイルが見つかりません。'}), 404
     except Exception as e:
         logger.error(f"Error downloading subtitle: {e}")
         return jsonify({'error': 'ファイルのダウンロードに失敗しました。'}), 404
@@ -1133,76 +1319,72 @@ def download_subtitle(filename):
 def download_video(filename):
     """動画ファイルのダウンロード"""
     try:
-        file_path = DOWNLOADS_DIR / filename
-        if not file_path.exists():
-            return jsonify({'error': 'ファイルが見つかりません。'}), 404
-
-        return send_file(
-            file_path,
+        # nginx配下の場合は、ファイル本体の送信をnginxに任せる
+        if X_ACCEL_REDIRECT_PREFIX:
+            file_path = safe_join(str(DOWNLOADS_DIR), filename)
+            if file_path is None or not os.path.isfile(file_path):
+                raise NotFound()
+            response = Response(mimetype='video/mp4')
+            response.headers['X-Accel-Redirect'] = f"{X_ACCEL_REDIRECT_PREFIX.rstrip('/')}/{quote(filename)}"
+            response.headers.set('Content-Disposition', 'attachment', filename=filename)
+            return response
+
+        # 条件付きリクエストと範囲リクエストに対応し、再ダウンロードや再開時の再送信を避ける
+        return send_from_directory(
+            DOWNLOADS_DIR,
+            filename,
             as_attachment=True,
             download_name=filename,
-            mimetype='video/mp4'
+            mimetype='video/mp4',
+            conditional=True,
+            max_age=VIDEO_MAX_AGE
         )
+    except NotFound:
+        return jsonify({'error': 'ファイルが見つかりません。'}), 404
     except Exception as e:
         logger.error(f"Error downloading video: {e}")
         return jsonify({'error': 'ファイルのダウンロードに失敗しました。'}), 404
 
-def cleanup_port(port):
-    """使用中のポートをクリーンアップ"""
-    try:
-        import psutil
-        
-        for proc in psutil.process_iter(['pid', 'name', 'connections']):
-            try:
-                # プロセスの接続情報を取得
-                connections = proc.connections()
-                for conn in connections:
-                    if hasattr(conn, 'laddr') and conn.laddr.port == port:
-                        # プロセスを終了
-                        psutil.Process(proc.pid).terminate()
-                        logger.info(f"Terminated process {proc.pid} using port {port}")
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                pass
-    except Exception as e:
-        logger.error(f"Error cleaning up port: {e}")
-
-def find_available_port(start_port=8000, max_port=9000):
-    """利用可能なポートを探す"""
-    import socket
-    
+def open_listener(start_port=8000, max_port=9000):
+    """利用可能なポートで待ち受けを開始し、ソケットとポート番号を返す"""
     for port in range(start_port, max_port):
+        # 空きポートの確認と待ち受けを1回のbindで行い、確認後に他のプロセスに取られる競合を避ける
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.bind(('', port))
-                logger.info(f"Found available port: {port}")
-                return port
+            # WindowsのSO_REUSEADDRは使用中のポートにもbindできてしまうため、それ以外の環境でのみ設定する
+            if os.name != 'nt':
+                listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind(('0.0.0.0', port))
+            listener.listen(128)
         except OSError:
+            listener.close()
             continue
+        logger.info(f"Found available port: {port}")
+        return listener, port
     
     raise RuntimeError("No available ports found")
 
 def open_browser(port):
     """指定されたポートでブラウザを開く"""
-    # サーバーの起動を少し待つ
-    time.sleep(3.0)
+    # 固定時間待たず、サーバーが接続を受け付けるようになった時点で開く
+    deadline = time.monotonic() + BROWSER_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            if s.connect_ex(('127.0.0.1', port)) == 0:
+                break
+        time.sleep(BROWSER_POLL_INTERVAL)
     webbrowser.open(f'http://localhost:{port}')
 
 if __name__ == '__main__':
     try:
-        # 環境変数をチェックしてメインプロセスかどうかを判断
-        if os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
-            port = find_available_port()
-            cleanup_port(port)
-            logger.info(f"Starting application on port {port}")
-            
-            # ブラウザを開くスレッドを起動（メインプロセスのみ）
-            threading.Thread(target=open_browser, args=(port,)).start()
-        else:
-            # リローダープロセスの場合は既存のポートを使用
-            port = find_available_port()
-            
-        # アプリケーションを起動
-        socketio.run(app, debug=True, port=port, host='0.0.0.0')
+        listener, port = open_listener()
+        logger.info(f"Starting application on port {port}")
+
+        # ブラウザを開くタスクを起動
+        socketio.start_background_task(open_browser, port)
+
+        # 確保済みのソケットのまま、geventのWSGIサーバーでアプリケーションを起動
+        WSGIServer(listener, app, handler_class=WebSocketHandler).serve_forever()
     except Exception as e:
         logger.error(f"Error starting application: {e}")
         logger.error(traceback.format_exc()) 
\ No newline at end of file
@@ -0,0 +1,219 @@
+// 字幕ファイルと動画URLはサーバー側で保持し、セッションIDで参照する
+let currentSessionId = '';
+// コピー時に<pre>から文字列を組み立て直さないよう、プロンプトを保持しておく
+let currentPrompt = '';
+let processingState = '';
+// ロングポーリングからのアップグレードを待たず、最初からWebSocketで接続
+let socket = io({ transports: ['websocket'], upgrade: false });
+// ジョブIDごとの完了待ち（結果がHTTP応答より先に届いた場合は保持しておく）
+let pendingJobs = {};
+let finishedJobs = {};
+
+socket.on('job_done', function(data) {
+    const resolve = pendingJobs[data.job_id];
+    if (resolve) {
+        delete pendingJobs[data.job_id];
+        resolve(data);
+    } else {
+        finishedJobs[data.job_id] = data;
+    }
+});
+
+socket.on('disconnect', function() {
+    Object.values(pendingJobs).forEach(resolve => resolve({ error: 'サーバーとの接続が切断されました。' }));
+    pendingJobs = {};
+});
+
+// ジョブの結果はsid宛てに届くため、接続が確立してから送信する
+function waitForConnect() {
+    if (socket.connected) {
+        return Promise.resolve();
+    }
+    return new Promise(resolve => socket.once('connect', resolve));
+}
+
+function waitForJob(jobId) {
+    return new Promise(resolve => {
+        if (jobId in finishedJobs) {
+            const data = finishedJobs[jobId];
+            delete finishedJobs[jobId];
+            resolve(data);
+        } else {
+            pendingJobs[jobId] = resolve;
+        }
+    });
+}
+
+// WebSocketからの進捗状況更新を処理
+// タスクごとの最新の進捗状況（描画は次のフレームでまとめて行う）
+let pendingProgress = {};
+let progressFrameRequested = false;
+
+socket.on('progress_update', function(data) {
+    pendingProgress[data.task] = data.progress;
+    if (!progressFrameRequested) {
+        progressFrameRequested = true;
+        requestAnimationFrame(renderProgress);
+    }
+});
+
+function renderProgress() {
+    progressFrameRequested = false;
+    const loading = document.querySelector('.loading');
+    const videoProcessing = document.querySelector('.video-processing');
+
+    if ('subtitles' in pendingProgress) {
+        // 字幕取得の進捗を更新
+        const progress = pendingProgress.subtitles;
+        loading.style.display = 'block';
+        const progressBar = loading.querySelector('.progress-bar');
+        const loadingText = loading.querySelector('.loading-text');
+
+        loadingText.textContent = `字幕を取得中... ${progress}%`;
+        progressBar.style.width = `${progress}%`;
+    }
+    if ('video' in pendingProgress) {
+        // 動画処理の進捗を更新
+        const progress = pendingProgress.video;
+        videoProcessing.style.display = 'block';
+        const progressBar = videoProcessing.querySelector('.progress-bar');
+        const loadingText = videoProcessing.querySelector('.loading-text');
+
+        loadingText.textContent = `動画を処理中... ${progress}%`;
+        progressBar.style.width = `${progress}%`;
+    }
+    pendingProgress = {};
+}
+
+function updateProgress(state, percent) {
+    const loading = document.querySelector('.loading');
+    loading.style.display = 'block';
+}
+
+document.getElementById('urlForm').addEventListener('submit', async (e) => {
+    e.preventDefault();
+
+    const loading = document.querySelector('.loading');
+    const resultCard = document.getElementById('resultCard');
+    const gptResponseCard = document.getElementById('gptResponseCard');
+    const promptResult = document.getElementById('promptResult');
+    const segmentsContainer = document.getElementById('segmentsContainer');
+
+    loading.style.display = 'block';
+    resultCard.style.display = 'none';
+    gptResponseCard.style.display = 'none';
+    segmentsContainer.innerHTML = '';
+
+    try {
+        await waitForConnect();
+        const response = await fetch('/process', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                url: e.target.elements.url.value,
+                sid: socket.id
+            })
+        });
+
+        const job = await response.json();
+        if (job.error) {
+            alert(job.error);
+            return;
+        }
+
+        const data = await waitForJob(job.job_id);
+
+        if (data.error) {
+            alert(data.error);
+            return;
+        }
+
+        currentSessionId = data.session_id;
+        currentPrompt = data.prompt;
+        promptResult.textContent = data.prompt;
+        resultCard.style.display = 'block';
+        gptResponseCard.style.display = 'block';
+    } catch (error) {
+        alert('エラーが発生しました: ' + error.message);
+    } finally {
+        loading.style.display = 'none';
+    }
+});
+
+async function processGptResponse() {
+    const videoProcessing = document.querySelector('.video-processing');
+    const segmentsContainer = document.getElementById('segmentsContainer');
+    const extractButton = document.getElementById('extractButton');
+    const gptResponse = document.getElementById('gptResponseInput').value;
+
+    if (!gptResponse) {
+        alert('ChatGPTの応答を入力してください。');
+        return;
+    }
+
+    videoProcessing.style.display = 'block';
+    // 結果が届くまでは同じ応答で切り出しを重ねて開始させない
+    extractButton.disabled = true;
+
+    try {
+        await waitForConnect();
+        const response = await fetch('/extract', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                gpt_response: gptResponse,
+                session_id: currentSessionId,
+                sid: socket.id
+            })
+        });
+
+        const job = await response.json();
+        if (job.error) {
+            alert(job.error);
+            return;
+        }
+
+        const data = await waitForJob(job.job_id);
+
+        if (data.error) {
+            alert(data.error);
+            return;
+        }
+
+        // サーバー側で描画済みのカードを一度に挿入する
+        segmentsContainer.innerHTML = data.segments_html;
+    } catch (error) {
+        alert('エラーが発生しました: ' + error.message);
+    } finally {
+        videoProcessing.style.display = 'none';
+        extractButton.disabled = false;
+    }
+}
+
+// これより長いプロンプトはBlobとしてクリップボードに書き込む
+const LARGE_PROMPT_LENGTH = 1024 * 1024;
+
+function writePromptToClipboard(text) {
+    if (text.length > LARGE_PROMPT_LENGTH && typeof ClipboardItem !== 'undefined') {
+        const blob = new Blob([text], { type: 'text/plain' });
+        return navigator.clipboard.write([new ClipboardItem({ 'text/plain': blob })]);
+    }
+    return navigator.clipboard.writeText(text);
+}
+
+function copyToClipboard() {
+    const text = currentPrompt || document.getElementById('promptResult').textContent;
+    writePromptToClipboard(text)
+        .then(() => {
+            const copyButton = document.querySelector('.copy-button');
+            copyButton.textContent = 'コピーしました！';
+            setTimeout(() => {
+                copyButton.textContent = 'コピー';
+            }, 2000);
+        })
+        .catch(err => alert('コピーに失敗しました: ' + err));
+}
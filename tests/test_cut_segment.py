@@ -0,0 +1,70 @@
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+if not shutil.which('ffmpeg') or not shutil.which('ffprobe'):
+    pytest.skip("ffmpeg and ffprobe are required", allow_module_level=True)
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+app = pytest.importorskip('app')
+
+# 25fps・GOP 2秒の元動画を、先頭と末尾の両方に端数が出る位置（3秒から8秒間）で切り出す
+FPS = 25
+SOURCE_DURATION = 12
+CUT_START = 3.0
+CUT_DURATION = 8.0
+
+# libx264以外のエンコーダーと、切り出し時の再エンコードとは異なる設定のlibx264で元動画を作成する
+SOURCE_ENCODERS = {
+    'libopenh264': ['-c:v', 'libopenh264', '-g', str(FPS * 2)],
+    'libx264-cavlc': [
+        '-c:v', 'libx264', '-profile:v', 'high', '-pix_fmt', 'yuv420p',
+        '-x264-params', f"keyint={FPS * 2}:min-keyint={FPS * 2}:scenecut=0:cabac=0:ref=1:8x8dct=0"
+    ],
+}
+
+def available_encoders():
+    result = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'], capture_output=True, text=True)
+    return result.stdout
+
+@pytest.fixture(params=sorted(SOURCE_ENCODERS))
+def source_video(request, tmp_path):
+    if request.param.split('-')[0] not in available_encoders():
+        pytest.skip(f"{request.param} encoder is not available")
+    source_path = tmp_path / f"source_{request.param}.mp4"
+    subprocess.run([
+        'ffmpeg', '-v', 'error',
+        '-f', 'lavfi', '-i', f"testsrc2=size=320x240:rate={FPS}:duration={SOURCE_DURATION}",
+        '-f', 'lavfi', '-i', f"sine=frequency=440:duration={SOURCE_DURATION}",
+        *SOURCE_ENCODERS[request.param],
+        '-c:a', 'aac',
+        '-shortest',
+        '-y', str(source_path)
+    ], check=True)
+    return source_path
+
+def test_fast_cut_output_decodes_without_errors(source_video, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'FAST_CUT', True)
+    output_path = tmp_path / 'clip.mp4'
+
+    assert app.cut_segment(source_video, CUT_START, CUT_DURATION, output_path)
+
+    decode = subprocess.run(
+        ['ffmpeg', '-v', 'error', '-i', str(output_path), '-f', 'null', '-'],
+        capture_output=True, text=True
+    )
+    assert decode.returncode == 0
+    assert decode.stderr == ''
+
+    count = subprocess.run([
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'v:0',
+        '-count_frames',
+        '-show_entries', 'stream=nb_read_frames',
+        '-of', 'csv=p=0',
+        str(output_path)
+    ], capture_output=True, text=True, check=True)
+    assert int(count.stdout.strip()) == int(CUT_DURATION * FPS)